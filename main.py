@@ -1,7 +1,13 @@
 import asyncio
-import json
 import logging
-from urllib.parse import urljoin
+import os
+import random
+import sys
+import aiohttp
+import orjson
+from dataclasses import dataclass
+from urllib.parse import urljoin, urlparse, parse_qs
+from selectolax.parser import HTMLParser
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
 
@@ -10,7 +16,56 @@ logger = logging.getLogger(__name__)
 
 
 BASE_TIMEOUT = 3000
-RETRY_WAIT = 2
+RETRY_BASE_WAIT = 0.5
+RETRY_MAX_WAIT = 30
+RETRY_JITTER = 0.5
+USER_DATA_DIR = ".cache/pw"
+
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net", "facebook.net", "hotjar.com")
+
+CARD_SELECTOR = "div.card.thumbnail"
+CARD_FIELD_SELECTORS = {
+    "title": "a.title",
+    "price": "div.caption [itemprop=price]",
+    "rating": "div.ratings p[data-rating]",
+    "reviews": "[itemprop=reviewCount]",
+}
+DESCRIPTION_SELECTOR = "[itemprop=description]"
+PAGINATION_SELECTOR = "ul.pagination"
+PAGE_LINK_SELECTOR = "ul.pagination a.page-link[href]"
+NEXT_ITEM_SELECTOR = "ul.pagination li.next"
+NEXT_LINK_SELECTOR = "ul.pagination li.next a.page-link"
+
+EXTRACT_CARDS_JS = """
+([card, sel]) => Array.from(document.querySelectorAll(card)).map(el => ({
+    title: el.querySelector(sel.title)?.title ?? null,
+    price: el.querySelector(sel.price)?.innerText ?? null,
+    href: el.querySelector(sel.title)?.getAttribute('href') ?? null,
+    rating: el.querySelector(sel.rating)?.dataset.rating ?? null,
+    reviews: el.querySelector(sel.reviews)?.innerText ?? null,
+}))
+"""
+
+@dataclass(slots=True)
+class Laptop:
+    title: str
+    price: str
+    rating: int
+    reviews_count: int
+    product_url: str
+    description: str = "N/A"
+
+class SelectorNotFoundError(Exception):
+    pass
+
+def is_retryable(error):
+    # a selector that never showed up will not appear by reloading the same page
+    if isinstance(error, SelectorNotFoundError):
+        return False
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return True
 
 def retry_with_logging(func):
     async def retry_connection(*args, **kwargs):
@@ -27,9 +82,13 @@ def retry_with_logging(func):
                     logger.error(f"Attempt 1 failed for {func.__name__}: {str(e)}")
                 else:
                     logger.error(f"Attempt {min_attempt_cnt} failed for {func.__name__}: {str(e)}")
+                if not is_retryable(e):
+                    logger.error(f"Non-retryable error in {func.__name__}, raising exception")
+                    raise
                 if min_attempt_cnt < max_attempts_cnt:
-                    logger.info(f"Retrying in {RETRY_WAIT} seconds... ({min_attempt_cnt}/{max_attempts_cnt})")
-                    await asyncio.sleep(RETRY_WAIT)
+                    retry_wait = min(RETRY_MAX_WAIT, RETRY_BASE_WAIT * 2 ** (min_attempt_cnt - 1)) + random.uniform(0, RETRY_JITTER)
+                    logger.info(f"Retrying in {retry_wait:.2f} seconds... ({min_attempt_cnt}/{max_attempts_cnt})")
+                    await asyncio.sleep(retry_wait)
                     min_attempt_cnt += 1
                 else:
                     logger.error(f"All {max_attempts_cnt} attempts exhausted for {func.__name__}, raising exception")
@@ -38,55 +97,119 @@ def retry_with_logging(func):
 
     return retry_connection
 
+async def block_unneeded_resources(route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(host in request.url for host in BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def read_cdp_endpoint(user_data_dir, timeout=10):
+    # with --remote-debugging-port=0 Chromium picks a free port and records it in DevToolsActivePort
+    port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        try:
+            with open(port_file, encoding="utf-8") as f:
+                port = f.readline().strip()
+            if port:
+                return f"http://127.0.0.1:{port}"
+        except FileNotFoundError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"Browser did not report its debugging port in {port_file}")
+
 class LaptopsScraper:
-    def __init__(self, url):
-        self.url = url
-        self.collected_laptops_data = []
+    def __init__(self, url, concurrency=8, use_static=False, queue_size=64, limit=None, max_batch_size=8, batch_workers=4):
+        self.url = url.replace("/allinone/", "/static/") if use_static else url
+        self.limit = limit
+        self.collected_cnt = 0
+        self.saved_cnt = 0
+        self.concurrency = concurrency
+        self.max_batch_size = max_batch_size
+        self.batch_workers = batch_workers
+        self.page_pool = asyncio.Queue()
+        self.product_queue = asyncio.Queue(maxsize=queue_size)
+
+    async def open_page_pool(self, context):
+        logger.info(f"Opening page pool with {self.concurrency} pages")
+        for _ in range(self.concurrency):
+            page = await context.new_page()
+            # routing turns off the HTTP cache for this page; blocking assets saves more than the cache would
+            await page.route("**/*", block_unneeded_resources)
+            await self.page_pool.put(page)
+
+    def limit_reached(self):
+        return self.limit is not None and self.collected_cnt >= self.limit
 
+    async def close_page_pool(self):
+        while not self.page_pool.empty():
+            page = self.page_pool.get_nowait()
+            await page.close()
+
+    # only navigation is retried: products are streamed out as soon as they are queued,
+    # so re-running a whole producer step would queue and write them twice
     @retry_with_logging
-    async def make_requests(self, browser):
+    async def navigate(self, page, url):
+        logger.info(f"Navigating to {url}")
+        await page.goto(url, wait_until="domcontentloaded", timeout=15000)
+
+    async def make_requests(self):
         logger.info("***** make_requests *****")
-        page = await browser.new_page()
+        page_urls = []
+        page = await self.page_pool.get()
         try:
-            logger.info(f"Navigating to {self.url}")
-            await page.goto(self.url, timeout=15000)
-            await page.wait_for_load_state("networkidle", timeout=10000)
+            await self.navigate(page, self.url)
             await self.extract_data_from_page(page)
-            await self.get_pagination(page)
+            if self.limit_reached():
+                return
+            page_urls = await self.get_page_urls(page)
+            # the allinone variant has no pagination at all, so don't sit out get_pagination's wait for it
+            if not page_urls and await page.locator(PAGINATION_SELECTOR).count():
+                await self.get_pagination(page)
         finally:
-            await page.close()
+            await self.page_pool.put(page)
+        if page_urls:
+            await self.scrape_listing_pages(page_urls)
 
     @retry_with_logging
     async def extract_data_from_page(self, page):
         logger.info("***** extract_data_from_page *****")
         try:
-            await page.wait_for_selector('div[class="card thumbnail"]', timeout=10000)
-            laptops_items = await page.locator('div[class="card thumbnail"]').all()
-            logger.info(f"Found {len(laptops_items)} products on current page")
-            for laptops_data in laptops_items:
+            try:
+                await page.wait_for_selector(CARD_SELECTOR, timeout=10000)
+            except PlaywrightTimeoutError as e:
+                raise SelectorNotFoundError(f"No product cards found on {page.url}") from e
+            rows = await page.evaluate(EXTRACT_CARDS_JS, [CARD_SELECTOR, CARD_FIELD_SELECTORS])
+            logger.info(f"Found {len(rows)} products on current page")
+            for row in rows:
                 try:
-                    laptops_title = await laptops_data.locator('a[class="title"]').get_attribute('title')
-                    laptops_price = await laptops_data.locator('div.caption [itemprop="price"]').inner_text()
-                    href = await laptops_data.locator('a.title').get_attribute('href')
+                    laptops_title = row["title"]
+                    laptops_price = row["price"]
+                    href = row["href"]
                     product_url = urljoin(page.url, href) if href else None
                     try:
-                        laptops_rating_attr = await laptops_data.locator('div[class="ratings"] p[data-rating]').get_attribute('data-rating')
-                        laptops_rating = int(laptops_rating_attr) if laptops_rating_attr else 0
+                        laptops_rating = int(row["rating"]) if row["rating"] else 0
                     except (ValueError, TypeError):
                         laptops_rating = 0
                     try:
-                        laptops_reviews_text = await laptops_data.locator('[itemprop="reviewCount"]').inner_text()
+                        laptops_reviews_text = row["reviews"]
                         laptops_reviews_count = int(laptops_reviews_text.strip().split()[0]) if laptops_reviews_text else 0
                     except (ValueError, IndexError, AttributeError):
                         laptops_reviews_count = 0
+                    if self.limit_reached():
+                        logger.info(f"Reached limit of {self.limit} products, skipping the rest")
+                        break
                     if laptops_title and laptops_price and product_url:
-                        self.collected_laptops_data.append({
-                            "title": laptops_title.strip(),
-                            "price": laptops_price.strip(),
-                            "rating": laptops_rating,
-                            "reviews_count": laptops_reviews_count,
-                            "product_url": product_url
-                        })
+                        # count the product before awaiting put so concurrent pages cannot overshoot the limit
+                        self.collected_cnt += 1
+                        await self.product_queue.put(Laptop(
+                            title=laptops_title.strip(),
+                            price=laptops_price.strip(),
+                            rating=laptops_rating,
+                            reviews_count=laptops_reviews_count,
+                            product_url=product_url,
+                        ))
                     else:
                         logger.warning("Missing essential data for product, skipping")
                 except Exception as e:
@@ -97,25 +220,81 @@ class LaptopsScraper:
             logger.error(f"Error scraping current page: {e}")
             raise
 
-    @retry_with_logging
+    async def get_page_urls(self, page):
+        logger.info("***** get_page_urls *****")
+        hrefs = await page.eval_on_selector_all(
+            PAGE_LINK_SELECTOR, 'links => links.map(link => link.getAttribute("href"))'
+        )
+        page_numbers = []
+        for href in hrefs:
+            try:
+                page_numbers.append(int(parse_qs(urlparse(href).query)["page"][0]))
+            except (KeyError, IndexError, ValueError):
+                continue
+        if not page_numbers:
+            return []
+        last_page = max(page_numbers)
+        logger.info(f"Found {last_page} listing pages")
+        return [f"{self.url}?page={page_number}" for page_number in range(2, last_page + 1)]
+
+    async def scrape_listing_pages(self, page_urls):
+        logger.info("***** scrape_listing_pages *****")
+
+        async def fetch_listing(page_url):
+            page = await self.page_pool.get()
+            try:
+                if self.limit_reached():
+                    return
+                await self.navigate(page, page_url)
+                await self.extract_data_from_page(page)
+            finally:
+                await self.page_pool.put(page)
+
+        results = await asyncio.gather(*[fetch_listing(page_url) for page_url in page_urls], return_exceptions=True)
+        for page_url, result in zip(page_urls, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to scrape listing page {page_url}: {result}")
+        logger.info(f"Scraped {self.collected_cnt} products from {len(page_urls) + 1} pages.")
+
     async def get_pagination(self, page):
         logger.info("***** get_pagination *****")
         page_count = 1
-        while True:
+
+        async def advance_page(next_button):
+            max_attempts_cnt = 3
+            for attempt in range(1, max_attempts_cnt + 1):
+                try:
+                    await next_button.click()
+                    break
+                except Exception as e:
+                    logger.warning(f"Attempt {attempt} to click next on page {page_count} failed: {e}")
+                    if attempt == max_attempts_cnt:
+                        return False
+                    await asyncio.sleep(2 ** (attempt - 1))
+            # the click went through, so never click again here; that would skip a page
             try:
-                await page.wait_for_selector('ul.pagination', timeout=5000)
-                next_button = page.locator('ul.pagination li.next a.page-link')
+                await page.wait_for_selector(CARD_SELECTOR, timeout=30000)
+                return True
+            except PlaywrightTimeoutError:
+                logger.warning(f"Timed out waiting for page {page_count + 1} to render")
+                return False
+
+        while not self.limit_reached():
+            try:
+                await page.wait_for_selector(PAGINATION_SELECTOR, timeout=5000)
+                next_button = page.locator(NEXT_LINK_SELECTOR)
                 if await next_button.count() == 0:
                     logger.info("No more pages found.")
                     break
                 # Check if next button is disabled
-                next_li = page.locator('ul.pagination li.next')
+                next_li = page.locator(NEXT_ITEM_SELECTOR)
                 is_disabled = await next_li.get_attribute('class')
                 if is_disabled and 'disabled' in is_disabled:
                     logger.info("Next button is disabled, no more pages.")
                     break
-                await next_button.click()
-                await page.wait_for_load_state("networkidle", timeout=15000)
+                if not await advance_page(next_button):
+                    logger.warning(f"Could not advance past page {page_count}, stopping pagination.")
+                    break
                 page_count += 1
                 logger.info(f"Scraping page {page_count}")
                 await self.extract_data_from_page(page)
@@ -126,77 +305,163 @@ class LaptopsScraper:
                 logger.warning(f"Pagination failed on page {page_count}: {e}")
                 break
 
-        logger.info(f"Scraped {len(self.collected_laptops_data)} products from {page_count} pages.")
+        logger.info(f"Scraped {self.collected_cnt} products from {page_count} pages.")
 
     @retry_with_logging
-    async def get_product_description(self, browser, each_product_url):
+    async def get_product_description(self, session, laptop):
         logger.info("***** get_product_description *****")
-        go_to_each_detail_page = await browser.new_page()
-        try:
-            logger.info(f"Visiting product page: {each_product_url['product_url']}")
-            await go_to_each_detail_page.goto(each_product_url["product_url"], timeout=15000)
-            await go_to_each_detail_page.wait_for_load_state("networkidle", timeout=10000)
-            try:
-                await go_to_each_detail_page.wait_for_selector('[itemprop="description"]', timeout=5000)
-                description_elem = go_to_each_detail_page.locator('[itemprop="description"]').first
-                description = await description_elem.inner_text()
-                each_product_url["description"] = description.strip() if description else "N/A"
-            except PlaywrightTimeoutError:
-                logger.warning(f"Description element not found for: {each_product_url['product_url']}")
-                each_product_url["description"] = "N/A"
-            return each_product_url
+        logger.info(f"Visiting product page: {laptop.product_url}")
+        async with session.get(laptop.product_url) as response:
+            response.raise_for_status()
+            html = await response.text()
+        description_elem = HTMLParser(html).css_first(DESCRIPTION_SELECTOR)
+        if description_elem is None:
+            logger.warning(f"Description element not found for: {laptop.product_url}")
+        else:
+            laptop.description = description_elem.text(separator=" ", strip=True) or "N/A"
+        return laptop
 
-        except Exception as e:
-            logger.error(f"Error getting product description: {e}")
-            each_product_url["description"] = "N/A"
-            return each_product_url
+    async def get_product_batch(self):
+        batch = [await self.product_queue.get()]
+        while len(batch) < self.max_batch_size and not self.product_queue.empty():
+            batch.append(self.product_queue.get_nowait())
+        return batch
+
+    async def process_batch(self, session, output):
+        batch = await self.get_product_batch()
+        try:
+            results = await asyncio.gather(
+                *[self.get_product_description(session, laptop) for laptop in batch], return_exceptions=True
+            )
+            for laptop, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"Failed to get description for {laptop.product_url}: {result}")
+                # descriptions are set in place and default to "N/A", so the laptop itself is the record
+                output.write(orjson.dumps(laptop) + b"\n")
+                self.saved_cnt += 1
+            logger.info(f"Processed batch of {len(batch)}, {self.saved_cnt}/{self.collected_cnt} products done")
         finally:
-            await go_to_each_detail_page.close()
+            for _ in batch:
+                self.product_queue.task_done()
+
+    async def batch_worker(self, session, output):
+        while True:
+            await self.process_batch(session, output)
+
+    async def produce_products(self):
+        await self.make_requests()
+        logger.info(f"Queued {self.collected_cnt} products for description scraping")
+        await self.product_queue.join()
 
-    async def get_each_product_page_url(self, browser, items_cnt=0):
-        logger.info("***** get_each_product_page_url *****")
-        final_data = []
-        products_to_process = self.collected_laptops_data[items_cnt:2]
-        for idx, product_page_url in enumerate(products_to_process, start=items_cnt):
+    async def scrape_products(self, output):
+        logger.info("***** scrape_products *****")
+        connector = aiohttp.TCPConnector(limit=self.batch_workers * self.max_batch_size)
+        timeout = aiohttp.ClientTimeout(total=15)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            workers = [asyncio.create_task(self.batch_worker(session, output)) for _ in range(self.batch_workers)]
+            producer = asyncio.create_task(self.produce_products())
             try:
-                result = await self.get_product_description(browser, product_page_url.copy())
-                final_data.append(result)
-                logger.info(f"Processed product {idx + 1}/{len(products_to_process)}")
-            except Exception as e:
-                logger.warning(f"Failed to get description for {product_page_url.get('product_url', 'Unknown URL')}: {e}")
-                product_copy = product_page_url.copy()
-                product_copy["description"] = "N/A"
-                final_data.append(product_copy)
-        logger.info(f"Collected {len(final_data)} products with descriptions.")
-        return final_data
+                # workers only stop by raising (e.g. a failed write), which would otherwise leave join() or put() hanging
+                done, _ = await asyncio.wait([producer, *workers], return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is not producer:
+                        raise task.exception()
+                await producer
+            finally:
+                for task in [producer, *workers]:
+                    task.cancel()
+                await asyncio.gather(producer, *workers, return_exceptions=True)
+        logger.info(f"Saved {self.saved_cnt} products with descriptions.")
+        return self.saved_cnt
 
 
-async def main():
-    logger.info("***** main function *****")
-    url = "https://webscraper.io/test-sites/e-commerce/allinone/computers/laptops"
+async def run_scraper(p, cdp_endpoint, url, output, **scraper_options):
+    logger.info(f"***** run_scraper: {url} *****")
+    laptops_scraper = LaptopsScraper(url, **scraper_options)
+    browser = None
+    try:
+        browser = await p.chromium.connect_over_cdp(cdp_endpoint)
+        # the default context is the launcher's persistent one, so cookies carry over between runs
+        context = browser.contexts[0]
+        await laptops_scraper.open_page_pool(context)
+        await laptops_scraper.scrape_products(output)
+    except Exception as E:
+        logger.error(f"Scraping failed: {E}")
+    finally:
+        await laptops_scraper.close_page_pool()
+        if browser:
+            await browser.close()
+            logger.info("Disconnected from shared browser.")
+
 
-    # you can try for pagination
-    # url = "https://webscraper.io/test-sites/e-commerce/static/computers/laptops"
+async def launch_browser(p):
+    # drop a port file left behind by an earlier run so we only read our own browser's port
+    stale_port_file = os.path.join(USER_DATA_DIR, "DevToolsActivePort")
+    if os.path.exists(stale_port_file):
+        os.remove(stale_port_file)
+    persistent_context = await p.chromium.launch_persistent_context(
+        USER_DATA_DIR,
+        headless=True,
+        args=['--no-sandbox', '--disable-dev-shm-usage', '--remote-debugging-port=0'],
+    )
+    try:
+        cdp_endpoint = await read_cdp_endpoint(USER_DATA_DIR)
+    except RuntimeError:
+        await persistent_context.close()
+        raise
+    return persistent_context, cdp_endpoint
 
-    laptops_scraper = LaptopsScraper(url)
 
+async def run_launcher():
+    logger.info("***** run_launcher *****")
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True, args=['--no-sandbox', '--disable-dev-shm-usage'])
+        persistent_context, cdp_endpoint = await launch_browser(p)
         try:
-            await laptops_scraper.make_requests(browser)
-            all_results = await laptops_scraper.get_each_product_page_url(browser)
-            output_file = "e-commerce-laptops.json"
-            try:
-                with open(output_file, mode="a", encoding="utf-8") as f:
-                    json.dump(all_results, f, indent=2, ensure_ascii=False)
-                logger.info(f"Successfully saved {len(all_results)} products to {output_file}")
-            except IOError as E:
-                logger.error(f"Failed to save results to file: {E}")
-        except Exception as E:
-            logger.error(f"Scraping failed: {E}")
+            print(cdp_endpoint, flush=True)
+            logger.info(f"Shared browser listening on {cdp_endpoint}, press Ctrl+C to stop it")
+            await asyncio.Event().wait()
         finally:
-            await browser.close()
+            await persistent_context.close()
+            logger.info("Browser closed.")
+
+
+async def run_workers(p, cdp_endpoint):
+    # pass use_static=True to LaptopsScraper to scrape the paginated static variant instead
+    urls = ["https://webscraper.io/test-sites/e-commerce/allinone/computers/laptops"]
+    # set SCRAPE_LIMIT to cap how many products each scraper collects
+    scrape_limit = os.environ.get("SCRAPE_LIMIT")
+    scraper_options = {"limit": int(scrape_limit)} if scrape_limit else {}
+    output_file = "e-commerce-laptops.jsonl"
+    try:
+        # unbuffered so every record is a single O_APPEND write that other worker processes cannot split
+        with open(output_file, mode="ab", buffering=0) as output:
+            await asyncio.gather(*[run_scraper(p, cdp_endpoint, url, output, **scraper_options) for url in urls])
+        logger.info(f"Results appended to {output_file}")
+    except IOError as E:
+        logger.error(f"Failed to save results to file: {E}")
+
+
+async def main():
+    logger.info("***** main function *****")
+    async with async_playwright() as p:
+        # set CDP_ENDPOINT to the address printed by `python main.py launch` to use that shared browser
+        cdp_endpoint = os.environ.get("CDP_ENDPOINT")
+        if cdp_endpoint:
+            await run_workers(p, cdp_endpoint)
+            return
+        # no shared browser given, so start a private one that lives only as long as this run
+        persistent_context, cdp_endpoint = await launch_browser(p)
+        try:
+            await run_workers(p, cdp_endpoint)
+        finally:
+            await persistent_context.close()
             logger.info("Browser closed.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if sys.argv[1:] == ["launch"]:
+        try:
+            asyncio.run(run_launcher())
+        except KeyboardInterrupt:
+            logger.info("Launcher stopped.")
+    else:
+        asyncio.run(main())
\ No newline at end of file